@@ -1,17 +1,248 @@
 """Build hook helpers for mozautodbg."""
 
+import json
+import mmap
 import os
 
 import subprocess
 import sys
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Generator, List
+from typing import Dict, Generator, Iterable, Iterator, List, Set, Tuple
 from contextlib import contextmanager
 import re
 from typing import Optional
 import logging
 
+CACHE_FILE: Path = (
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    / "mozautodbg"
+    / "gitcache.json"
+)
+GIT_DIR: Path = Path(".git")
+
+# Matches a line starting with "mk_add_options" followed by whitespace, then
+# "MOZ_OBJDIR=", and captures the rest of the line if it is not blank.
+_MOZ_OBJDIR_RE = re.compile(
+    rb"^[ \t]*mk_add_options[ \t]+MOZ_OBJDIR=[ \t]*(\S.*)$", re.MULTILINE
+)
+_SHA_RE = re.compile(r"^(?:[0-9a-f]{40}|[0-9a-f]{64})$")
+
+
+def _refs_readable() -> bool:
+    """
+    Return True if refs are stored as files below .git that can be read
+    directly. This is not the case for worktrees and submodules, where .git
+    is a file, nor for the reftable backend, where .git/refs/heads is a stub
+    file and HEAD points at the placeholder refs/heads/.invalid.
+    """
+    if not (GIT_DIR / "refs" / "heads").is_dir():
+        return False
+    try:
+        head = (GIT_DIR / "HEAD").read_text().strip()
+    except OSError:
+        return False
+    return head != "ref: refs/heads/.invalid"
+
+
+def _lookup_packed_refs(refname: str) -> Optional[str]:
+    """Return the object name of refname from .git/packed-refs, if present."""
+    pattern = re.compile(
+        rb"^([0-9a-f]{40}|[0-9a-f]{64}) " + re.escape(refname.encode()) + rb"$",
+        re.MULTILINE,
+    )
+    try:
+        with open(GIT_DIR / "packed-refs", "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                match = pattern.search(mm)
+                return match.group(1).decode("ascii") if match else None
+    except (OSError, ValueError):
+        # Missing or empty packed-refs.
+        return None
+
+
+def _read_ref(refname: str) -> Optional[str]:
+    """
+    Resolve refname (e.g. "HEAD" or "refs/heads/main") by reading .git directly,
+    following symbolic refs. Returns None if the ref cannot be resolved this way.
+    """
+    if not _refs_readable():
+        return None
+    # Bound the number of symbolic refs followed to guard against cycles.
+    for _ in range(5):
+        try:
+            content = (GIT_DIR / refname).read_text().strip()
+        except OSError:
+            content = _lookup_packed_refs(refname) or ""
+        if content.startswith("ref: "):
+            refname = content[len("ref: ") :]
+            continue
+        return content if _SHA_RE.match(content) else None
+    return None
+
+
+def _resolve_rev(rev: str) -> Optional[str]:
+    """
+    Resolve a commit SHA or ref name without spawning git, using the same
+    lookup order as git itself. Returns None for anything more complex.
+    """
+    if _SHA_RE.match(rev):
+        return rev
+    candidates = [
+        f"refs/{rev}",
+        f"refs/tags/{rev}",
+        f"refs/heads/{rev}",
+        f"refs/remotes/{rev}",
+        f"refs/remotes/{rev}/HEAD",
+    ]
+    if re.match(r"^[A-Z_]+$", rev):
+        candidates.insert(0, rev)
+    for refname in candidates:
+        sha = _read_ref(refname)
+        if sha is not None:
+            return sha
+    return None
+
+
+def _read_cache() -> dict:
+    """Return the whole cache, or an empty one if it is missing or malformed."""
+    try:
+        cache = json.loads(CACHE_FILE.read_bytes())
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _make_cache_dir() -> None:
+    """
+    Create the per-user cache directory, which also holds generated hook
+    files, so that only the current user can access it.
+    """
+    CACHE_FILE.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+
+def _write_atomically(path: Path, data: bytes) -> None:
+    """
+    Write data to path through a temporary file in the same directory, so
+    that readers never see a partially written file.
+    """
+    import tempfile
+
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def _load_cache(name: str, key: dict) -> Optional[object]:
+    """
+    Return the cached value stored under name for the current repository,
+    or None if there is none or it was stored for a different key.
+    """
+    repo = _read_cache().get(str(Path.cwd().resolve()))
+    entry = repo.get(name) if isinstance(repo, dict) else None
+    if not isinstance(entry, dict) or entry.get("key") != key:
+        return None
+    return entry.get("value")
+
+
+def _save_cache(name: str, key: dict, value: object) -> None:
+    """Store value under name for the current repository."""
+    cache = _read_cache()
+    repo = cache.get(str(Path.cwd().resolve()))
+    if not isinstance(repo, dict):
+        repo = cache[str(Path.cwd().resolve())] = {}
+    repo[name] = {"key": key, "value": value}
+    try:
+        _make_cache_dir()
+        _write_atomically(CACHE_FILE, json.dumps(cache).encode("utf-8"))
+    except OSError as e:
+        logging.debug("Unable to write cache file %s: %s", CACHE_FILE, e)
+
+
+def _merge_base_cache_key(target: str) -> Optional[dict]:
+    """Key identifying the merge base of HEAD and target, if both resolve."""
+    head = _resolve_rev("HEAD")
+    target_sha = _resolve_rev(target)
+    if head is None or target_sha is None:
+        return None
+    return {"head": head, "target": target_sha}
+
+
+def _compute_merge_base(target: str) -> str:
+    """
+    Run `git merge-base HEAD target`, reusing a cached result if neither HEAD
+    nor target moved since the last run. Raises CalledProcessError on failure.
+    """
+    key = _merge_base_cache_key(target)
+    if key is not None:
+        cached = _load_cache("merge_base", key)
+        if isinstance(cached, str):
+            logging.debug("Using cached merge base: %s", cached)
+            return cached
+    merge_base = (
+        subprocess.check_output(["git", "merge-base", "HEAD", target])
+        .strip()
+        .decode("ascii")
+    )
+    if key is not None:
+        _save_cache("merge_base", key, merge_base)
+    return merge_base
+
+
+def _find_default_branch(candidates: List[str]) -> Optional[str]:
+    """Return the first of candidates that exists as a local branch."""
+    if _refs_readable():
+        for branch in candidates:
+            if _read_ref(f"refs/heads/{branch}") is not None:
+                return branch
+        return None
+    # Refs cannot be read directly (e.g. a worktree or reftable): ask git
+    # about all candidates at once.
+    refs = [f"refs/heads/{branch}" for branch in candidates]
+    try:
+        output = subprocess.check_output(
+            ["git", "for-each-ref", "--format=%(refname)", *refs]
+        )
+    except subprocess.CalledProcessError:
+        return None
+    # Patterns also match refs below them (refs/heads/main/foo), so compare
+    # full names.
+    existing = set(output.decode("utf-8", "surrogateescape").splitlines())
+    for branch, ref in zip(candidates, refs):
+        if ref in existing:
+            return branch
+    return None
+
+
+def _current_branch() -> str:
+    """
+    Return the name of the current branch, or "HEAD" if it is detached,
+    like `git rev-parse --abbrev-ref HEAD`.
+    """
+    if _refs_readable():
+        try:
+            head = (GIT_DIR / "HEAD").read_text().strip()
+        except OSError:
+            head = ""
+        if head.startswith("ref: refs/heads/"):
+            return head[len("ref: refs/heads/") :]
+        if _SHA_RE.match(head):
+            return "HEAD"
+    try:
+        return (
+            subprocess.check_output(["git", "rev-parse", "--abbrev-ref", "HEAD"])
+            .strip()
+            .decode("utf-8", "surrogateescape")
+        )
+    except subprocess.CalledProcessError:
+        logging.error("Unable to determine the current branch.")
+        sys.exit("Error: Unable to determine the current branch.")
+
 
 def get_local_merge_base(base_override: str | None = None) -> str:
     """
@@ -24,10 +255,7 @@ def get_local_merge_base(base_override: str | None = None) -> str:
     if base_override:
         logging.info("Using provided merge base override: %s", base_override)
         try:
-            merge_base = subprocess.check_output(
-                ["git", "merge-base", "HEAD", base_override],
-                text=True,
-            ).strip()
+            merge_base = _compute_merge_base(base_override)
             logging.debug(
                 "Merge base with override '%s': %s", base_override, merge_base
             )
@@ -47,26 +275,12 @@ def get_local_merge_base(base_override: str | None = None) -> str:
         default_branch = None
 
     if not default_branch:
-        for branch in ["main", "master"]:
-            try:
-                subprocess.check_output(
-                    ["git", "rev-parse", "--verify", branch], text=True
-                )
-                default_branch = branch
-                break
-            except subprocess.CalledProcessError:
-                continue
+        default_branch = _find_default_branch(["main", "master"])
         if not default_branch:
             logging.error("Unable to find a default branch ('main' or 'master').")
             sys.exit("Error: Unable to find a default branch 'main' or 'master'.")
 
-    try:
-        current_branch = subprocess.check_output(
-            ["git", "rev-parse", "--abbrev-ref", "HEAD"], text=True
-        ).strip()
-    except subprocess.CalledProcessError:
-        logging.error("Unable to determine the current branch.")
-        sys.exit("Error: Unable to determine the current branch.")
+    current_branch = _current_branch()
 
     target = (
         f"origin/{default_branch}"
@@ -75,9 +289,7 @@ def get_local_merge_base(base_override: str | None = None) -> str:
     )
     logging.info("Using target branch: %s", target)
     try:
-        merge_base = subprocess.check_output(
-            ["git", "merge-base", "HEAD", target], text=True
-        ).strip()
+        merge_base = _compute_merge_base(target)
         logging.debug("Computed merge base: %s", merge_base)
         return merge_base
     except subprocess.CalledProcessError as e:
@@ -85,69 +297,187 @@ def get_local_merge_base(base_override: str | None = None) -> str:
         sys.exit(f"Error: Unable to determine merge base with branch {target}.")
 
 
+def _changed_file_entries(cmd: List[str]) -> Iterator[bytes]:
+    """
+    Run a git command listing changed files with NUL-separated output and
+    yield its entries while git is still producing them.
+    """
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    stdout = proc.stdout
+    assert stdout is not None
+    pending = b""
+    with proc:
+        for chunk in iter(stdout.read1, b""):
+            entries = (pending + chunk).split(b"\x00")
+            # The last entry may be continued by the next chunk.
+            pending = entries.pop()
+            yield from entries
+    if pending:
+        yield pending
+    if proc.returncode != 0:
+        logging.error(
+            "Unable to determine changed files using %s: exit status %d",
+            " ".join(cmd),
+            proc.returncode,
+        )
+        sys.exit(
+            "Error: Unable to determine changed files. Are you in a git repository?"
+        )
+
+
+def _directories(paths: Iterable[bytes]) -> Set[str]:
+    """Return the set of parent directories of paths, excluding the root."""
+    dirs = {p[: p.rfind(b"/")] for p in paths if b"/" in p}
+    dirs.discard(b"")
+    return {d.decode("utf-8", "surrogateescape") for d in dirs}
+
+
+def _committed_directories(merge_base: str) -> Set[str]:
+    """
+    Return the directories changed between merge_base and HEAD, reusing a
+    cached result if HEAD did not move since the last run.
+    """
+    head = _resolve_rev("HEAD")
+    key = {"head": head, "merge_base": merge_base}
+    if head is not None:
+        cached = _load_cache("committed_dirs", key)
+        if isinstance(cached, list):
+            logging.debug("Using cached committed directories")
+            return set(cached)
+    dirs = _directories(
+        _changed_file_entries(["git", "diff", "--name-only", "-z", merge_base, "HEAD"])
+    )
+    if head is not None:
+        _save_cache("committed_dirs", key, sorted(dirs))
+    return dirs
+
+
 def get_changed_directories(merge_base: str) -> List[str]:
     """
     Return a sorted list of unique directories that have changed relative to merge_base.
     This function incorporates committed, staged, and unstaged changes.
+
+    Committed changes come from a single (cached) `git diff` against merge_base,
+    staged and unstaged changes from a single `git status`, which always runs
+    because edits to the working tree are not reflected in anything cheaper.
+    Both git commands are independent and run concurrently.
     """
-    changed_files = set()
-    commands = [
-        ["git", "diff", "--name-only", merge_base, "HEAD"],  # Committed changes
-        ["git", "diff", "--name-only", merge_base],  # Unstaged (working tree) changes
-        ["git", "diff", "--name-only", "--cached", merge_base],  # Staged changes
-    ]
-    for cmd in commands:
-        try:
-            output = subprocess.check_output(cmd, text=True)
-            for line in output.strip().splitlines():
-                changed_files.add(line)
-        except subprocess.CalledProcessError as e:
-            logging.error(
-                "Unable to determine changed files using %s: %s", " ".join(cmd), e
-            )
-            sys.exit(
-                "Error: Unable to determine changed files. Are you in a git repository?"
-            )
-    dirs = {str(Path(f).parent) for f in changed_files if Path(f).parent != Path(".")}
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        committed = executor.submit(_committed_directories, merge_base)
+        uncommitted = _changed_file_entries(
+            [
+                "git",
+                "-c",
+                "core.quotepath=off",
+                "status",
+                "--porcelain=v1",
+                "-z",
+                "--untracked-files=no",
+            ]
+        )
+        uncommitted_dirs = _directories(_parse_porcelain_status(uncommitted))
+        dirs = committed.result()
+    dirs.update(uncommitted_dirs)
     return sorted(dirs)
 
 
+def _parse_porcelain_status(entries: Iterator[bytes]) -> Iterator[bytes]:
+    """
+    Extract the paths from the entries of `git status --porcelain=v1 -z`.
+
+    Each entry is "XY PATH"; renames and copies are followed by an extra
+    entry holding the original path, which is reported as changed as well.
+    """
+    for entry in entries:
+        if len(entry) < 4:
+            continue
+        yield entry[3:]
+        # Either status column may report a rename or copy.
+        if b"R" in entry[:2] or b"C" in entry[:2]:
+            yield next(entries, b"")
+
+
+def _collapse_nested_directories(directories: List[str]) -> List[str]:
+    """
+    Drop directories that lie below another directory of the list, since the
+    build hook already matches everything below a listed directory.
+    """
+    collapsed: List[str] = []
+    prev: Optional[str] = None
+    # Sorting by path components puts every directory directly before its
+    # subdirectories ("a/b" < "a/b/c" < "a/b-c"), unlike plain string order.
+    for d in sorted({d.rstrip("/") for d in directories}, key=lambda d: d.split("/")):
+        if prev is None or not d.startswith(prev + "/"):
+            collapsed.append(d)
+            prev = d
+    return sorted(collapsed)
+
+
+def _file_has_content(path: Path, content: bytes) -> bool:
+    """
+    Return True if the file at path exists and holds exactly content.
+    The file is only read if its size matches.
+    """
+    try:
+        if path.stat().st_size != len(content):
+            return False
+        return path.read_bytes() == content
+    except FileNotFoundError:
+        return False
+
+
 @contextmanager
-def write_build_hook(directories: List[str]) -> Generator[str, None, None]:
+def write_build_hook(
+    directories: List[str], mozconfig: str | None
+) -> Generator[Tuple[str, str], None, None]:
     """
     Write a temporary Python file with the build hook.
     The hook disables optimization (sets COMPILE_FLAGS['OPTIMIZE'] = [])
     for directories that match.
+    It is placed in the objdir set in the given mozconfig, if there is one.
+    Yields the path of the hook file together with its content.
+
+    The hook runs inside the moz.build sandbox, which allows neither imports
+    nor most builtins. All directories are therefore emitted as one tuple of
+    prefixes so that a single str.startswith call checks them all.
     """
+    prefixes = tuple(d.rstrip("/") + "/" for d in directories)
     hook_lines = [
-        "noopt = " + repr(directories),
-        "for no in noopt:",
-        "    if RELATIVEDIR.startswith(no):",
-        "        COMPILE_FLAGS['OPTIMIZE'] = []",
+        "noopt = " + repr(prefixes),
+        "if (RELATIVEDIR + '/').startswith(noopt):",
+        "    COMPILE_FLAGS['OPTIMIZE'] = []",
     ]
     hook_content = "\n".join(hook_lines) + "\n"
+    hook_bytes = hook_content.encode("utf-8")
 
-    objdir = extract_moz_objdir(os.environ["MOZCONFIG"])
+    objdir = extract_moz_objdir(mozconfig) if mozconfig else None
     if objdir is not None:
         hook_filename = (Path(objdir) / ".build_hook").resolve()
         logging.info("Using hook file %s", hook_filename)
-        if not hook_filename.exists():
-            hook_filename.touch()
-        old_hook_content = hook_filename.read_text()
-        if old_hook_content != hook_content:
+        if not _file_has_content(hook_filename, hook_bytes):
             logging.info("Hook file has changes. Overwriting.")
-            with open(hook_filename, "w") as f:
-                f.write(hook_content)
+            with open(hook_filename, "wb") as f:
+                f.write(hook_bytes)
         else:
             logging.info("Using the existing hook file")
-        yield str(hook_filename)
+        yield str(hook_filename), hook_content
     else:
-        with tempfile.NamedTemporaryFile(
-            suffix=".py", mode="w", encoding="utf-8"
-        ) as temp_file:
-            logging.info("Could not determine objdir. Using temp file.")
-            temp_file.write(hook_content)
-            yield temp_file.name
+        # Only needed for this fallback; it is comparatively slow to import.
+        import hashlib
+
+        # The file has to outlive this process because ./mach replaces it. There
+        # is one file per repository, rewritten atomically whenever the hook
+        # changes, so old hooks do not pile up. It lives in the per-user cache
+        # directory, since a predictable name in the shared temp directory
+        # could be created or swapped by another user.
+        repo = str(Path.cwd().resolve()).encode("utf-8", "surrogateescape")
+        digest = hashlib.sha1(repo).hexdigest()[:16]
+        hook_filename = CACHE_FILE.parent / f"hook-{digest}.py"
+        logging.info("Could not determine objdir. Using hook file %s", hook_filename)
+        if not _file_has_content(hook_filename, hook_bytes):
+            _make_cache_dir()
+            _write_atomically(hook_filename, hook_bytes)
+        yield str(hook_filename), hook_content
 
 
 def extract_moz_objdir(file_path: str) -> Optional[str]:
@@ -161,18 +491,16 @@ def extract_moz_objdir(file_path: str) -> Optional[str]:
       mk_add_options MOZ_OBJDIR=/path/to/objdir
 
     """
-    # The regex ensures that the line starts with "mk_add_options" followed by whitespace,
-    # then "MOZ_OBJDIR=" and then captures the rest of the line.
-    pattern = re.compile(r"^mk_add_options\s+MOZ_OBJDIR=(.+)$")
-
-    with open(file_path, "r") as f:
-        for line in f:
-            line = line.strip()
-            match = pattern.match(line)
-            if match:
-                # Extract and return the value (stripping any extra whitespace)
-                return match.group(1).strip().replace("@TOPSRCDIR@", os.curdir)
-    return None
+    # Read in one go rather than mapping the file: mozconfigs are small and
+    # may be special files (/dev/null, process substitution) that cannot be
+    # mapped.
+    with open(file_path, "rb") as f:
+        match = _MOZ_OBJDIR_RE.search(f.read())
+    if not match:
+        return None
+    # Return the value, stripping any extra whitespace
+    objdir = match.group(1).strip().decode("utf-8", "surrogateescape")
+    return objdir.replace("@TOPSRCDIR@", os.curdir)
 
 
 def execute_mach(
@@ -182,17 +510,23 @@ def execute_mach(
     include: List[str],
     ignore: List[str],
     mach_args: List[str],
+    scan: bool = True,
 ) -> int:
     """
     Execute the mach command with the generated temporary build hook.
 
     The final list of directories is computed as:
        (changed_dirs ∪ include) minus any directory that matches an ignore pattern.
+    If scan is False, git is not queried and changed_dirs is empty.
     If --show-hook is given and no mach_args are provided, prints the hook and returns 0.
     Otherwise, sets MOZ_BUILD_HOOK (and optionally MOZCONFIG) and runs ./mach.
     """
-    merge_base: str = get_local_merge_base(base)
-    changed_dirs: List[str] = get_changed_directories(merge_base)
+    changed_dirs: List[str] = []
+    if scan:
+        merge_base: str = get_local_merge_base(base)
+        changed_dirs = get_changed_directories(merge_base)
+    else:
+        logging.info("Not scanning for changed directories.")
     logging.debug("Changed directories: %s", changed_dirs)
 
     # Compute union of changed directories and additional include directories.
@@ -203,36 +537,45 @@ def execute_mach(
     ignore_normalized = [ign if ign.endswith("/") else ign + "/" for ign in ignore]
     logging.debug("Ignoring directories: %s", ignore_normalized)
 
-    # Filter out directories that match any ignore pattern.
-    final_dirs: List[str] = list(
-        sorted(
-            d
-            for d in union_dirs
-            if not any(d == ign[:-1] or d.startswith(ign) for ign in ignore_normalized)
+    # Filter out directories that are an ignored directory or lie below one.
+    if ignore_normalized:
+        ignore_re = re.compile(
+            "^(?:"
+            + "|".join(re.escape(ign[:-1]) for ign in ignore_normalized)
+            + ")(?:/|$)"
         )
-    )
+        final_dirs: List[str] = sorted(d for d in union_dirs if not ignore_re.match(d))
+    else:
+        final_dirs = sorted(union_dirs)
+    final_dirs = _collapse_nested_directories(final_dirs)
     logging.debug("Final directories for hook: %s", final_dirs)
 
+    # Environment for mach; os.environ itself is left untouched.
+    env: Dict[str, str] = dict(os.environ)
     if mozconfig:
-        os.environ["MOZCONFIG"] = mozconfig
+        env["MOZCONFIG"] = mozconfig
         logging.info("Using MOZCONFIG: %s", mozconfig)
     else:
         logging.info("No MOZCONFIG override provided.")
 
-    with write_build_hook(final_dirs) as hook_path:
+    mozconfig_path = env.get("MOZCONFIG")
+    with write_build_hook(final_dirs, mozconfig_path) as (hook_path, hook_content):
         if show_hook:
-            hook_content: str = Path(hook_path).read_text()
-            loglevel = logging.getLogger().level
-            logging.getLogger().setLevel(logging.INFO)
-            logging.info("Generated hook content:\n%s", hook_content)
-            logging.getLogger().setLevel(loglevel)
-            os.environ["MOZ_BUILD_HOOK"] = hook_path
-
-        if len(mach_args) == 0:
-            return 0
+            # Written directly so it shows regardless of the log level.
+            sys.stderr.write(f"Generated hook content:\n{hook_content}\n")
+    env["MOZ_BUILD_HOOK"] = hook_path
 
-        mach_cmd: List[str] = ["./mach"] + mach_args
-        logging.info("Executing command: %s", " ".join(mach_cmd))
-        ret: int = subprocess.call(mach_cmd)
+    if len(mach_args) == 0:
+        return 0
 
-    return ret
+    mach_cmd: List[str] = ["./mach"] + mach_args
+    logging.info("Executing command: %s", " ".join(mach_cmd))
+    if os.name == "nt":
+        # exec on Windows spawns a new process and exits this one, which
+        # detaches mach from the console; wait for it instead.
+        return subprocess.call(mach_cmd, env=env)
+    # Nothing happens after mach exits, so replace this process instead of
+    # keeping it around for the duration of the build.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execvpe(mach_cmd[0], mach_cmd, env)
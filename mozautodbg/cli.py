@@ -8,6 +8,11 @@ import click
 
 from mozautodbg import build_hook, config as config_mod
 
+# None of the log records need thread or process information.
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+
 
 @click.group()
 @click.option(
@@ -50,24 +55,37 @@ def cli(ctx: click.Context, verbose: int) -> None:
     multiple=True,
     help="Set default ignore paths (can be provided multiple times)",
 )
+@click.option(
+    "--scan-mode",
+    type=click.Choice(config_mod.SCAN_MODES),
+    help="With 'manual', skip the scan for changed dirs if include paths are given",
+)
 def configure(
     mozconfig: str | None,
     branch: str | None,
     include: List[str],
     ignore: List[str],
+    scan_mode: str | None,
 ) -> None:
     """
     Configure mozautodbg.
 
     If no options are provided, an interactive TUI is launched.
+    If only --scan-mode is provided, only the scan mode is changed.
     Otherwise, non-interactive configuration uses sensible defaults:
       - Default branch: bookmarks/central
       - Default mozconfig: $HOME/mozconfig (absolute path, must exist)
+      - Scan mode: auto
     """
-    if mozconfig is None and branch is None and not include and not ignore:
+    other_options_given = (
+        mozconfig is not None or branch is not None or bool(include) or bool(ignore)
+    )
+    if not other_options_given and scan_mode is None:
         config_mod.interactive_configure()
+    elif not other_options_given:
+        config_mod.configure_scan_mode(scan_mode)
     else:
-        config_mod.configure_defaults(mozconfig, branch, include, ignore)
+        config_mod.configure_defaults(mozconfig, branch, include, ignore, scan_mode)
 
 
 @cli.command(
@@ -82,6 +100,11 @@ def configure(
     help="Override the merge base target (branch name or commit SHA)",
 )
 @click.option("--show-hook", is_flag=True, help="Print the generated build hook file")
+@click.option(
+    "--no-scan",
+    is_flag=True,
+    help="Do not scan for changed directories; only use the include paths",
+)
 @click.option(
     "--include",
     multiple=True,
@@ -99,6 +122,7 @@ def mach(
     mozconfig: str | None,
     base: str | None,
     show_hook: bool,
+    no_scan: bool,
     include: List[str],
     ignore: List[str],
     mach_args: List[str],
@@ -108,9 +132,13 @@ def mach(
 
     The final list of directories is computed as:
       (changed_dirs ∪ include) minus any directory that matches an ignore pattern.
+    Changed directories are not scanned with --no-scan, or if include paths are
+    given and the scan mode is configured as 'manual'.
     If --show-hook is given and no mach arguments are provided,
     the hook is printed and the command exits.
     """
+    # Reading the configuration also migrates a legacy INI file.
+    cfg = config_mod.get_config()
     if not config_mod.CONFIG_FILE.exists():
         logging.info(
             "Configuration file not found. Launching interactive configuration."
@@ -118,13 +146,20 @@ def mach(
         config_mod.interactive_configure()
         return
 
+    include_dirs: List[str] = list(include) or config_mod.get_include_value(cfg)
+    scan: bool = not no_scan and not (
+        include_dirs
+        and config_mod.get_scan_mode_value(cfg) == config_mod.SCAN_MODE_MANUAL
+    )
+
     ret: int = build_hook.execute_mach(
-        mozconfig or config_mod.get_config()["DEFAULT"]["mozconfig"],
+        mozconfig or config_mod.get_default_mozconfig_value(cfg),
         base,
         show_hook,
-        list(include) or config_mod.get_config()["DEFAULT"]["include"],
-        list(ignore) or config_mod.get_config()["DEFAULT"]["ignore"],
+        include_dirs,
+        list(ignore) or config_mod.get_ignore_value(cfg),
         list(mach_args),
+        scan=scan,
     )
     sys.exit(ret)
 
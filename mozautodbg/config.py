@@ -1,63 +1,117 @@
 """Configuration helpers for mozautodbg."""
 
-import configparser
+import json
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List
 import sys
-import questionary
 import logging
 
-CONFIG_FILE: Path = Path.home() / ".mozautodbg.ini"
+CONFIG_FILE: Path = Path.home() / ".mozautodbg.json"
+# Configuration written by older versions, migrated on first use.
+LEGACY_CONFIG_FILE: Path = Path.home() / ".mozautodbg.ini"
+
+# With "manual", changed directories are not scanned if include paths are given.
+SCAN_MODE_AUTO = "auto"
+SCAN_MODE_MANUAL = "manual"
+SCAN_MODES: List[str] = [SCAN_MODE_AUTO, SCAN_MODE_MANUAL]
+
+
+def get_config() -> Dict[str, Any]:
+    try:
+        config = json.loads(CONFIG_FILE.read_bytes())
+    except FileNotFoundError:
+        if LEGACY_CONFIG_FILE.exists():
+            return _migrate_legacy_config()
+        return {}
+    except ValueError as e:
+        logging.error(
+            "Error: The configuration file %s is not valid JSON (%s). "
+            "Fix it, or remove it and run 'mozautodbg configure'.",
+            CONFIG_FILE,
+            e,
+        )
+        sys.exit(1)
+    if not isinstance(config, dict):
+        logging.error(
+            "Error: The configuration file %s must contain a JSON object. "
+            "Fix it, or remove it and run 'mozautodbg configure'.",
+            CONFIG_FILE,
+        )
+        sys.exit(1)
+    return config
 
 
-def get_config() -> configparser.ConfigParser:
-    config = configparser.ConfigParser()
-    if CONFIG_FILE.exists():
-        config.read(CONFIG_FILE)
-    else:
-        config["DEFAULT"] = {}
+def save_config(config: Dict[str, Any]) -> None:
+    CONFIG_FILE.write_text(json.dumps(config, indent=2) + "\n")
+
+
+def _migrate_legacy_config() -> Dict[str, Any]:
+    """
+    Convert the INI configuration of older versions to JSON and save it.
+    configparser is only imported for this one-time migration.
+    """
+    import configparser
+
+    legacy = configparser.ConfigParser()
+    legacy.read(LEGACY_CONFIG_FILE)
+    defaults = legacy["DEFAULT"]
+
+    config: Dict[str, Any] = {}
+    if "mozconfig" in defaults:
+        set_default_mozconfig_value(config, defaults["mozconfig"])
+    if "branch" in defaults:
+        set_default_branch_value(config, defaults["branch"])
+    set_include_value(config, _split_list(defaults.get("include", "")))
+    set_ignore_value(config, _split_list(defaults.get("ignore", "")))
+    save_config(config)
+    logging.info(
+        "Migrated configuration from %s to %s", LEGACY_CONFIG_FILE, CONFIG_FILE
+    )
     return config
 
 
-def save_config(config: configparser.ConfigParser) -> None:
-    with CONFIG_FILE.open("w") as f:
-        config.write(f)
+def _split_list(val: str) -> List[str]:
+    return [x.strip() for x in val.split(",") if x.strip()]
 
 
-def set_default_mozconfig_value(config: configparser.ConfigParser, path: str) -> None:
-    config["DEFAULT"]["mozconfig"] = path
+def set_default_mozconfig_value(config: Dict[str, Any], path: str) -> None:
+    config["mozconfig"] = path
 
 
-def get_default_mozconfig_value(config: configparser.ConfigParser) -> str | None:
-    return config["DEFAULT"].get("mozconfig")
+def get_default_mozconfig_value(config: Dict[str, Any]) -> str | None:
+    return config.get("mozconfig")
 
 
-def set_default_branch_value(config: configparser.ConfigParser, branch: str) -> None:
-    config["DEFAULT"]["branch"] = branch
+def set_default_branch_value(config: Dict[str, Any], branch: str) -> None:
+    config["branch"] = branch
 
 
-def get_default_branch_value(config: configparser.ConfigParser) -> str | None:
-    return config["DEFAULT"].get("branch")
+def get_default_branch_value(config: Dict[str, Any]) -> str | None:
+    return config.get("branch")
 
 
-def set_include_value(
-    config: configparser.ConfigParser, include_list: List[str]
-) -> None:
-    config["DEFAULT"]["include"] = ",".join(include_list)
+def set_include_value(config: Dict[str, Any], include_list: List[str]) -> None:
+    config["include"] = list(include_list)
 
 
-def get_include_value(config: configparser.ConfigParser) -> List[str]:
-    val = config["DEFAULT"].get("include", "")
-    return [x.strip() for x in val.split(",") if x.strip()]
+def get_include_value(config: Dict[str, Any]) -> List[str]:
+    return list(config.get("include", []))
 
 
-def set_ignore_value(config: configparser.ConfigParser, ignore_list: List[str]) -> None:
-    config["DEFAULT"]["ignore"] = ",".join(ignore_list)
+def set_ignore_value(config: Dict[str, Any], ignore_list: List[str]) -> None:
+    config["ignore"] = list(ignore_list)
 
 
-def get_ignore_value(config: configparser.ConfigParser) -> List[str]:
-    val = config["DEFAULT"].get("ignore", "")
-    return [x.strip() for x in val.split(",") if x.strip()]
+def get_ignore_value(config: Dict[str, Any]) -> List[str]:
+    return list(config.get("ignore", []))
+
+
+def set_scan_mode_value(config: Dict[str, Any], scan_mode: str) -> None:
+    config["scan_mode"] = scan_mode
+
+
+def get_scan_mode_value(config: Dict[str, Any]) -> str:
+    return config.get("scan_mode", SCAN_MODE_AUTO)
 
 
 def interactive_configure() -> None:
@@ -65,12 +119,16 @@ def interactive_configure() -> None:
     Launch an interactive configuration TUI using questionary.
     Uses logging to display messages.
     """
+    # questionary pulls in prompt_toolkit, which is slow to import and only
+    # needed here.
+    import questionary
 
     cfg = get_config()
     current_mozconfig: str = get_default_mozconfig_value(cfg) or ""
     current_branch: str = get_default_branch_value(cfg) or ""
     current_include: List[str] = get_include_value(cfg)
     current_ignore: List[str] = get_ignore_value(cfg)
+    current_scan_mode: str = get_scan_mode_value(cfg)
 
     new_mozconfig: str = questionary.text(
         "Enter the default mozconfig file", default=current_mozconfig
@@ -87,6 +145,12 @@ def interactive_configure() -> None:
         "Enter default ignore paths (comma separated)",
         default=",".join(current_ignore) if current_ignore else "",
     ).ask()  # type: ignore
+    new_scan_mode: str = questionary.select(
+        "Scan for changed directories when include paths are given?"
+        " (manual: no, auto: yes)",
+        choices=SCAN_MODES,
+        default=current_scan_mode,
+    ).ask()  # type: ignore
     confirm: bool = questionary.confirm("Save these settings?").ask()  # type: ignore
 
     if confirm:
@@ -99,31 +163,45 @@ def interactive_configure() -> None:
             sys.exit(1)
         set_default_mozconfig_value(cfg, str(mozconfig_path))
         set_default_branch_value(cfg, new_branch)
-        include_list: List[str] = [
-            s.strip() for s in new_include_str.split(",") if s.strip()
-        ]
-        ignore_list: List[str] = [
-            s.strip() for s in new_ignore_str.split(",") if s.strip()
-        ]
+        include_list: List[str] = _split_list(new_include_str)
+        ignore_list: List[str] = _split_list(new_ignore_str)
         set_include_value(cfg, include_list)
         set_ignore_value(cfg, ignore_list)
+        set_scan_mode_value(cfg, new_scan_mode)
         save_config(cfg)
         logging.info("Configuration saved.")
     else:
         logging.info("Exiting without saving changes.")
 
 
+def configure_scan_mode(scan_mode: str) -> None:
+    """
+    Change only the scan mode of an existing configuration.
+    """
+    cfg = get_config()
+    if not CONFIG_FILE.exists():
+        logging.error(
+            "Error: No configuration found. Run 'mozautodbg configure' first."
+        )
+        sys.exit(1)
+    set_scan_mode_value(cfg, scan_mode)
+    save_config(cfg)
+    logging.info("Scan mode set to: %s", scan_mode)
+
+
 def configure_defaults(
     mozconfig: str | None,
     branch: str | None,
     include: List[str],
     ignore: List[str],
+    scan_mode: str | None = None,
 ) -> None:
     """
     Configure defaults non-interactively.
     Uses the following sensible defaults if missing:
       - Default branch: "bookmarks/central"
       - Default mozconfig: $HOME/mozconfig
+      - Scan mode: "auto"
     When setting the mozconfig file, its path is expanded to an absolute path and verified to exist.
     """
 
@@ -155,4 +233,9 @@ def configure_defaults(
         "Default ignore paths set to: %s", ", ".join(ignore) if ignore else "None"
     )
 
+    if scan_mode is None:
+        scan_mode = SCAN_MODE_AUTO
+    set_scan_mode_value(cfg, scan_mode)
+    logging.info("Scan mode set to: %s", scan_mode)
+
     save_config(cfg)